@@ -3,7 +3,14 @@ import streamlit as st
 import requests
 import pandas as pd
 import sqlite3
-import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from diskcache import Cache
+except ImportError:  # optional: without it fetches are only cached in-process
+    Cache = None
 
 # -----------------------
 # Config / Title
@@ -15,18 +22,23 @@ API_KEY = "07e3776a-04b1-4c47-98c8-5a8dd7f08b51"
 BASE_URL = "https://api.harvardartmuseums.org/object"
 DB_NAME = "artifacts.db"
 DEFAULT_FETCH_LIMIT = 2500
+PAGE_SIZE = 100
+FETCH_WORKERS = 8
+FETCH_CACHE_DIR = ".harvard_cache"
+FETCH_CACHE_TTL = 86400
+TABLE_PAGE_SIZE = 200
+JSON_PREVIEW_ROWS = 100
+
+META_COLS = ["id","title","culture","dated","period","division","medium","dimensions","weight","department","accessionyear","classification"]
+MEDIA_COLS = ["object_id","imagecount","mediacount","colorcount","rank","datedbegin","datedend"]
+COLOR_COLS = ["object_id","hue","percentage"]
 
 # -----------------------
 # Session state defaults
 # -----------------------
-for key in ("meta_df", "media_df", "colors_df", "collected", "inserted", "show_choice", "migrate_click", "show_queries", "raw_data", "show_tables_after_insert", "combined_meta_df", "combined_media_df", "combined_colors_df", "inserted_classifications"):
+for key in ("meta_df", "media_df", "colors_df", "collected", "inserted", "show_choice", "migrate_click", "show_queries", "raw_data", "download_json", "show_tables_after_insert"):
     if key not in st.session_state:
-        if key.startswith("combined_"):
-            st.session_state[key] = pd.DataFrame()
-        elif key == "inserted_classifications":
-            st.session_state[key] = set()
-        else:
-            st.session_state[key] = False if key in ("collected", "inserted", "show_choice", "migrate_click", "show_queries", "show_tables_after_insert") else None
+        st.session_state[key] = False if key in ("collected", "inserted", "show_choice", "migrate_click", "show_queries", "show_tables_after_insert") else None
         if key == "raw_data":
             st.session_state[key] = {}
 
@@ -34,11 +46,25 @@ for key in ("meta_df", "media_df", "colors_df", "collected", "inserted", "show_c
 # -----------------------
 # DB functions
 # -----------------------
+@st.cache_resource
 def get_conn():
-    return sqlite3.connect(DB_NAME, check_same_thread=False)
+    """Shared SQLite connection, opened once per server process and reused across reruns."""
+    # larger statement cache keeps the compiled QUERIES/upserts around across reruns
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    init_db(conn)
+    return conn
 
-def init_db():
-    conn = get_conn()
+@st.cache_resource
+def get_db_lock():
+    """Process-wide lock serializing use of the shared connection across session threads."""
+    return threading.Lock()
+
+def init_db(conn: sqlite3.Connection):
+    """Create tables and indexes; called once when the shared connection is opened."""
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS artifact_metadata (
@@ -75,113 +101,148 @@ def init_db():
             PRIMARY KEY (object_id, hue)
         );
     """)
+    # filter columns used by QUERIES; the object_id join columns are already
+    # covered by the primary keys of artifact_media / artifact_colors
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_meta_culture ON artifact_metadata(culture);")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_meta_period ON artifact_metadata(period);")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_meta_class ON artifact_metadata(classification);")
+    # case-insensitive lookup used by already_inserted()
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_meta_class_nocase ON artifact_metadata(classification COLLATE NOCASE);")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_meta_accyear ON artifact_metadata(accessionyear);")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_colors_hue ON artifact_colors(hue);")
     conn.commit()
-    conn.close()
 
-init_db()
+def already_inserted(classification: str) -> bool:
+    """True if the database already holds rows for this classification (case-insensitive)."""
+    with get_db_lock():
+        row = get_conn().execute(
+            "SELECT 1 FROM artifact_metadata WHERE classification = ? COLLATE NOCASE LIMIT 1;", (classification,)
+        ).fetchone()
+    return row is not None
 
 # -----------------------
 # Fetch / transform functions
 # -----------------------
+@st.cache_resource
+def get_fetch_cache():
+    """On-disk cache of fetch results so they survive server restarts (None if diskcache is missing)."""
+    return Cache(FETCH_CACHE_DIR) if Cache is not None else None
+
+def _fetch_page(session: requests.Session, classification: str, page: int) -> dict:
+    """Fetch a single result page for a classification."""
+    params = {"apikey": API_KEY, "classification": classification, "size": PAGE_SIZE, "page": page}
+    r = session.get(BASE_URL, params=params, timeout=60)
+    r.raise_for_status()
+    return r.json()
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_data(classification: str, limit: int = DEFAULT_FETCH_LIMIT):
     """Fetch up to `limit` records for a classification from Harvard API."""
-    raw_records = []
-    meta_rows, media_rows, color_rows = [], [], []
-    page = 1
-    collected = 0
-    while collected < limit:
-        params = {"apikey": API_KEY, "classification": classification, "size": 100, "page": page}
-        r = requests.get(BASE_URL, params=params, timeout=60)
-        r.raise_for_status()
-        payload = r.json()
-        records = payload.get("records", [])
-        if not records:
-            break
-        raw_records.extend(records)
-        for obj in records:
-            meta_rows.append({
-                "id": obj.get("id"),
-                "title": obj.get("title"),
-                "culture": obj.get("culture"),
-                "dated": obj.get("dated"),
-                "period": obj.get("period"),
-                "division": obj.get("division"),
-                "medium": obj.get("medium"),
-                "dimensions": obj.get("dimensions"),
-                "weight": obj.get("weight"),
-                "department": obj.get("department"),
-                "accessionyear": obj.get("accessionyear"),
-                "classification": classification
-            })
-            media_rows.append({
-                "object_id": obj.get("id"),
-                "imagecount": obj.get("imagecount"),
-                "mediacount": obj.get("mediacount"),
-                "colorcount": obj.get("colorcount"),
-                "rank": obj.get("rank"),
-                "datedbegin": obj.get("datedbegin"),
-                "datedend": obj.get("datedend")
-            })
-            for c in (obj.get("colors") or []):
-                color_rows.append({
-                    "object_id": obj.get("id"),
-                    "hue": c.get("hue"),
-                    "percentage": c.get("percent")
-                })
-        collected += len(records)
-        page += 1
-        if "info" in payload and page > payload["info"].get("pages", page):
-            break
-
-    meta_df = pd.DataFrame(meta_rows).drop_duplicates(subset=["id"], keep="first")
-    media_df = pd.DataFrame(media_rows).drop_duplicates(subset=["object_id"], keep="first")
-    colors_df = pd.DataFrame(color_rows).dropna(subset=["hue"])
-    return meta_df, media_df, colors_df, raw_records
+    disk_cache = get_fetch_cache()
+    key = (classification, limit)
+    cached = disk_cache.get(key) if disk_cache is not None else None
+    if cached is not None:
+        return cached
+
+    with requests.Session() as session:
+        # first page tells us how many pages exist; the rest are fetched concurrently
+        first = _fetch_page(session, classification, 1)
+        n_pages = min(math.ceil(limit / PAGE_SIZE), first.get("info", {}).get("pages", 1))
+        payloads = [first]
+        if n_pages > 1:
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+                payloads.extend(pool.map(lambda p: _fetch_page(session, classification, p), range(2, n_pages + 1)))
+
+    # the API occasionally repeats objects across pages; keep the first occurrence of each id
+    raw_records, seen_ids = [], set()
+    for payload in payloads:
+        for obj in payload.get("records", []):
+            oid = obj.get("id")
+            if oid in seen_ids:
+                continue
+            seen_ids.add(oid)
+            raw_records.append(obj)
+    # only pull the fields we store; flattening every nested field of every object is far slower
+    fields = [c for c in META_COLS if c != "classification"] + [c for c in MEDIA_COLS if c != "object_id"]
+    records_df = pd.DataFrame.from_records(raw_records, columns=fields)
+    meta_df = records_df.reindex(columns=META_COLS)
+    meta_df["classification"] = classification
+    media_df = records_df.rename(columns={"id": "object_id"}).reindex(columns=MEDIA_COLS)
+    color_rows = [(obj.get("id"), c.get("hue"), c.get("percent")) for obj in raw_records for c in (obj.get("colors") or [])]
+    colors_df = pd.DataFrame(color_rows, columns=COLOR_COLS)
+    colors_df = colors_df.dropna(subset=["hue"])
+
+    # low-cardinality text columns are far cheaper to hold and serialize as categoricals
+    meta_df = meta_df.astype({c: "category" for c in ("culture", "period", "division", "department", "classification")})
+    colors_df = colors_df.astype({"hue": "category"})
+    result = (meta_df, media_df, colors_df, raw_records)
+    if disk_cache is not None:
+        disk_cache.set(key, result, expire=FETCH_CACHE_TTL)
+    return result
+
+def preview_records(df: pd.DataFrame, show_all: bool = False) -> list:
+    """JSON-safe records for st.json (NaN -> None), capped at JSON_PREVIEW_ROWS unless `show_all`."""
+    frame = df if show_all else df.head(JSON_PREVIEW_ROWS)
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
 
 # -----------------------
 # Insert (upsert-safe)
 # -----------------------
+def _frame_records(df: pd.DataFrame, cols: list, int_cols: tuple = ()) -> list:
+    """Materialize `cols` of `df` as DB-ready rows (NaN -> None, id columns as int)."""
+    out = df.reindex(columns=cols)
+    for c in int_cols:
+        out[c] = out[c].astype("Int64")
+    out = out.astype(object).where(out.notna(), None)
+    # one C-level ndarray.tolist() instead of zipping columns row by row
+    return out.to_numpy().tolist()
+
+def _upsert_sql(table: str, cols: list, key_cols: list) -> str:
+    """INSERT ... ON CONFLICT DO UPDATE for `table` (updates in place instead of delete+insert)."""
+    placeholders = ",".join(["?"]*len(cols))
+    updates = ",".join(f"{c}=excluded.{c}" for c in cols if c not in key_cols)
+    return (f"INSERT INTO {table} ({','.join(cols)}) VALUES ({placeholders}) "
+            f"ON CONFLICT({','.join(key_cols)}) DO UPDATE SET {updates}")
+
 def insert_frames(meta_df: pd.DataFrame, media_df: pd.DataFrame, colors_df: pd.DataFrame):
     conn = get_conn()
-    cur = conn.cursor()
-    # metadata upsert
-    if not meta_df.empty:
-        cols = ["id","title","culture","dated","period","division","medium","dimensions","weight","department","accessionyear","classification"]
-        placeholders = ",".join(["?"]*len(cols))
-        sql = f"INSERT OR REPLACE INTO artifact_metadata ({','.join(cols)}) VALUES ({placeholders})"
-        records = []
-        for _, row in meta_df.iterrows():
-            vals = []
-            for c in cols:
-                v = row.get(c)
-                if c == "id" and pd.notna(v):
-                    vals.append(int(v))
-                else:
-                    vals.append(None if pd.isna(v) else v)
-            records.append(tuple(vals))
-        cur.executemany(sql, records)
-    # media upsert
-    if not media_df.empty:
-        cols = ["object_id","imagecount","mediacount","colorcount","rank","datedbegin","datedend"]
-        placeholders = ",".join(["?"]*len(cols))
-        sql = f"INSERT OR REPLACE INTO artifact_media ({','.join(cols)}) VALUES ({placeholders})"
-        records = []
-        for _, row in media_df.iterrows():
-            vals = [None if pd.isna(row.get(c)) else row.get(c) for c in cols]
-            records.append(tuple(vals))
-        cur.executemany(sql, records)
-    # colors upsert (composite PK)
-    if not colors_df.empty:
-        cols = ["object_id","hue","percentage"]
-        placeholders = ",".join(["?"]*len(cols))
-        sql = f"INSERT OR REPLACE INTO artifact_colors ({','.join(cols)}) VALUES ({placeholders})"
-        records = []
-        for _, row in colors_df.iterrows():
-            vals = [None if pd.isna(row.get(c)) else row.get(c) for c in cols]
-            records.append(tuple(vals))
-        cur.executemany(sql, records)
-    conn.commit()
-    conn.close()
+    # the connection is shared by every session; hold the lock so transactions don't interleave
+    with get_db_lock():
+        # single transaction for all three upserts (one commit / fsync)
+        with conn:
+            cur = conn.cursor()
+            # metadata upsert
+            if not meta_df.empty:
+                cols = META_COLS
+                sql = _upsert_sql("artifact_metadata", cols, ["id"])
+                cur.executemany(sql, _frame_records(meta_df, cols, int_cols=("id",)))
+            # media upsert
+            if not media_df.empty:
+                cols = MEDIA_COLS
+                sql = _upsert_sql("artifact_media", cols, ["object_id"])
+                cur.executemany(sql, _frame_records(media_df, cols, int_cols=("object_id",)))
+            # colors upsert (composite PK)
+            if not colors_df.empty:
+                cols = COLOR_COLS
+                sql = _upsert_sql("artifact_colors", cols, ["object_id","hue"])
+                cur.executemany(sql, _frame_records(colors_df, cols, int_cols=("object_id",)))
+        # refresh planner statistics so the new indexes get picked up
+        conn.execute("ANALYZE;")
+
+@st.cache_data
+def run_query(sql: str, params: tuple = ()) -> pd.DataFrame:
+    """Run a read-only query; results are memoized until the next insert clears them."""
+    with get_db_lock():
+        return pd.read_sql_query(sql, get_conn(), params=params)
+
+def show_table_page(table: str, order_by: str):
+    """Render one LIMIT/OFFSET page of `table` so a rerun never loads the whole table."""
+    total = int(run_query(f"SELECT COUNT(*) AS n FROM {table};")["n"].iloc[0])
+    last_page = max(0, (total - 1) // TABLE_PAGE_SIZE)
+    page = st.number_input(f"Page ({table})", min_value=0, max_value=last_page, value=0, step=1, key=f"page_{table}")
+    offset = int(page) * TABLE_PAGE_SIZE
+    sql = f"SELECT * FROM {table} ORDER BY {order_by} LIMIT ? OFFSET ?;"
+    st.dataframe(run_query(sql, (TABLE_PAGE_SIZE, offset)), use_container_width=True)
 
 # -----------------------
 # Queries (25). #14 handled dynamically in UI.
@@ -233,28 +294,26 @@ QUERIES = {
     "23. What is the most common artifact in every period?":
         """
         WITH counts AS (
-            SELECT period, title, COUNT(*) AS cnt
+            SELECT period, title, COUNT(*) AS cnt,
+                   RANK() OVER (PARTITION BY period ORDER BY COUNT(*) DESC) AS rnk
             FROM artifact_metadata
             WHERE period IS NOT NULL
             GROUP BY period, title
-        ), maxes AS (
-            SELECT period, MAX(cnt) AS max_cnt FROM counts GROUP BY period
         )
-        SELECT c.period, c.title, c.cnt FROM counts c JOIN maxes m ON c.period=m.period AND c.cnt=m.max_cnt ORDER BY c.period;
+        SELECT period, title, cnt FROM counts WHERE rnk = 1 ORDER BY period;
         """,
     "24. How many colors are used these artifacts":
         "SELECT COUNT(DISTINCT hue) AS total_unique_colors FROM artifact_colors WHERE hue IS NOT NULL;",
     "25. What is the most common artifact in every culture?":
         """
         WITH counts AS (
-            SELECT culture, title, COUNT(*) AS cnt
+            SELECT culture, title, COUNT(*) AS cnt,
+                   RANK() OVER (PARTITION BY culture ORDER BY COUNT(*) DESC) AS rnk
             FROM artifact_metadata
             WHERE culture IS NOT NULL
             GROUP BY culture, title
-        ), maxes AS (
-            SELECT culture, MAX(cnt) AS max_cnt FROM counts GROUP BY culture
         )
-        SELECT c.culture, c.title, c.cnt FROM counts c JOIN maxes m ON c.culture=m.culture AND c.cnt=m.max_cnt ORDER BY c.culture;
+        SELECT culture, title, cnt FROM counts WHERE rnk = 1 ORDER BY culture;
         """
 }
 
@@ -269,9 +328,11 @@ with middle:
 with right:
     if st.button("Collect Data"):
         if classification:
-            if classification.lower() in st.session_state["inserted_classifications"]:
+            if already_inserted(classification):
                 st.error(f"The classification '{classification}' has already been inserted!")
             else:
+                # no re-entry guard needed: a session runs one script at a time, and a repeat
+                # click just interrupts this run; identical fetches hit fetch_data's cache
                 with st.spinner("Fetching data..."):
                     try:
                         meta_df, media_df, colors_df, raw_data = fetch_data(classification)
@@ -279,6 +340,11 @@ with right:
                         st.session_state["media_df"] = media_df
                         st.session_state["colors_df"] = colors_df
                         st.session_state["raw_data"] = raw_data
+                        # serialized once per collect so the download buttons don't redo it every rerun
+                        st.session_state["download_json"] = {
+                            name: df.to_json(orient="records", indent=4).encode()
+                            for name, df in (("meta", meta_df), ("media", media_df), ("colors", colors_df))
+                        }
                         st.session_state["collected"] = True
                         st.session_state["inserted"] = False
                         st.session_state["show_choice"] = True
@@ -315,25 +381,26 @@ if b3.button("📄 SQL Queries"):
 
 
 # -----------------------
-# Select Your Choice (show collected data as expanded JSON)
+# Select Your Choice (collapsible JSON preview; full set via download)
 # -----------------------
 if st.session_state.get("show_choice", False):
     if not st.session_state.get("collected", False):
         st.warning("Please collect data first.")
     else:
+        show_all = st.checkbox("Show all records", value=False, key="json_show_all")
         c1, c2, c3 = st.columns(3)
         with c1:
             st.markdown("**Metadata**")
-            json_str = json.dumps(st.session_state["meta_df"].to_dict('records'), indent=4)
-            st.code(json_str, language="json")
+            st.json(preview_records(st.session_state["meta_df"], show_all), expanded=False)
+            st.download_button("Download full JSON", data=st.session_state["download_json"]["meta"], file_name="metadata.json", mime="application/json", key="dl_meta")
         with c2:
             st.markdown("**Media**")
-            json_str = json.dumps(st.session_state["media_df"].to_dict('records'), indent=4)
-            st.code(json_str, language="json")
+            st.json(preview_records(st.session_state["media_df"], show_all), expanded=False)
+            st.download_button("Download full JSON", data=st.session_state["download_json"]["media"], file_name="media.json", mime="application/json", key="dl_media")
         with c3:
             st.markdown("**Colors**")
-            json_str = json.dumps(st.session_state["colors_df"].to_dict('records'), indent=4)
-            st.code(json_str, language="json")
+            st.json(preview_records(st.session_state["colors_df"], show_all), expanded=False)
+            st.download_button("Download full JSON", data=st.session_state["download_json"]["colors"], file_name="colors.json", mime="application/json", key="dl_colors")
 
 # -----------------------
 # Migrate to SQL (Insert only)
@@ -344,37 +411,30 @@ if st.session_state.get("migrate_click", False):
         st.warning("Please collect data first.")
     else:
         if st.button("Insert"):
-            if classification.lower() in st.session_state["inserted_classifications"]:
+            if already_inserted(classification):
                 st.error(f"The classification '{classification}' already exists!")
             else:
                 try:
                     insert_frames(st.session_state["meta_df"], st.session_state["media_df"], st.session_state["colors_df"])
+                    run_query.clear()
                     st.session_state["inserted"] = True
                     st.session_state["show_tables_after_insert"] = True
-                    
-                    st.session_state["inserted_classifications"].add(classification.lower())
-                    
-                    st.session_state["combined_meta_df"] = pd.concat([st.session_state["combined_meta_df"], st.session_state["meta_df"]], ignore_index=True).drop_duplicates(subset=["id"], keep="first")
-                    st.session_state["combined_media_df"] = pd.concat([st.session_state["combined_media_df"], st.session_state["media_df"]], ignore_index=True).drop_duplicates(subset=["object_id"], keep="first")
-                    st.session_state["combined_colors_df"] = pd.concat([st.session_state["combined_colors_df"], st.session_state["colors_df"]], ignore_index=True).drop_duplicates(subset=["object_id", "hue"], keep="first")
-
                     st.success("Data inserted into database successfully.")
                 except Exception as e:
                     st.error(f"Insert failed: {e}")
 
 # -----------------------
-# Display the single combined table after each insert
+# Display the combined tables (read back from SQLite) after each insert
 # -----------------------
 if st.session_state.get("show_tables_after_insert", False):
-    if not st.session_state["combined_meta_df"].empty:
-        st.markdown("### Artifacts Metadata")
-        st.dataframe(st.session_state["combined_meta_df"], use_container_width=True)
+    st.markdown("### Artifacts Metadata")
+    show_table_page("artifact_metadata", "id")
 
-        st.markdown("### Artifacts Media")
-        st.dataframe(st.session_state["combined_media_df"], use_container_width=True)
+    st.markdown("### Artifacts Media")
+    show_table_page("artifact_media", "object_id")
 
-        st.markdown("### Artifacts Colors")
-        st.dataframe(st.session_state["combined_colors_df"], use_container_width=True)
+    st.markdown("### Artifacts Colors")
+    show_table_page("artifact_colors", "object_id, hue")
 
 # -----------------------
 # SQL Queries (25) - only run after insert
@@ -389,10 +449,12 @@ if st.session_state.get("show_queries", False):
         chosen = st.selectbox("Choose a question:", options, index=0)
 
         sql_to_run = None
+        params = ()
         if chosen.startswith("14."):
             artifact_id = st.text_input("Enter Artifact ID (numeric)", value="")
             if artifact_id and artifact_id.strip().isdigit():
-                sql_to_run = f"SELECT hue, percentage FROM artifact_colors WHERE object_id = {int(artifact_id)};"
+                sql_to_run = "SELECT hue, percentage FROM artifact_colors WHERE object_id = ?;"
+                params = (int(artifact_id),)
             else:
                 st.info("Please enter a numeric Artifact ID to run question 14.")
         else:
@@ -403,9 +465,7 @@ if st.session_state.get("show_queries", False):
                 st.info("Provide required input first.")
             else:
                 try:
-                    conn = get_conn()
-                    df_res = pd.read_sql_query(sql_to_run, conn)
-                    conn.close()
+                    df_res = run_query(sql_to_run, params)
                     if df_res.empty:
                         st.info("Query ran successfully but returned no rows.")
                     else: